@@ -1,12 +1,29 @@
 import os
+import io
+import asyncio
 import requests
-import time
+import httpx
+import uuid
+import hashlib
 import shutil
+import datetime
+import pathlib
+import time
+from collections import defaultdict, deque
+import ffmpeg
+import orjson
 import google.generativeai as genai
+from cachetools import TTLCache
+from google.api_core import exceptions as google_exceptions
+from google.api_core import retry_async
+from google.generativeai import caching
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from fastapi import FastAPI, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, DefaultHttpxClient
 
 # --- CONFIGURATION ---
 load_dotenv()
@@ -18,8 +35,64 @@ if not GROQ_API_KEY or not GEMINI_API_KEY:
     print("⚠️ CRITICAL: API Keys missing.")
 
 # Initialize Clients
-groq_client = Groq(api_key=GROQ_API_KEY)
+# Keep the api.groq.com connection alive between transcriptions (httpx's
+# default expiry is 5 s, so a quiet server re-handshakes on almost every call)
+groq_client = Groq(
+    api_key=GROQ_API_KEY,
+    # SDK retries 408/429/5xx and connection errors with jittered backoff,
+    # honouring Retry-After, so a transient blip doesn't fail the request
+    max_retries=3,
+    http_client=DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=16, keepalive_expiry=120),
+    ),
+)
 genai.configure(api_key=GEMINI_API_KEY)
+gemini_model = genai.GenerativeModel('gemini-2.0-flash')
+gemini_lite_model = genai.GenerativeModel('gemini-2.0-flash-lite')
+GEMINI_MODELS = (gemini_model, gemini_lite_model)
+
+# The hedge waits for the p95 of recent successful calls of the same kind
+# (notes vs chat) on the same model before racing the next model against it.
+# Until enough samples exist it uses a conservative default, so normal
+# generations never pay for two models. A primary that loses the race is
+# cancelled, so its elapsed time is recorded as a lower bound; otherwise the
+# slowest calls would never enter the window and the p95 would drift down.
+GEMINI_LATENCY = defaultdict(lambda: deque(maxlen=100))
+GEMINI_HEDGE_DEFAULTS = {"notes": 60.0, "chat": 15.0}
+GEMINI_HEDGE_MIN_SAMPLES = 20
+# Bounded exponential backoff on 500/503 from Gemini. 429s are not retried in
+# place: the model goes into cooldown and the hedge falls over to the next one.
+GEMINI_RETRY = retry_async.AsyncRetry(
+    predicate=retry_async.if_exception_type(
+        google_exceptions.InternalServerError,
+        google_exceptions.ServiceUnavailable,
+    ),
+    initial=0.5, maximum=4.0, multiplier=2.0, timeout=30.0,
+)
+# Model name -> monotonic time before which it is skipped. A rate-limited model
+# sits out GEMINI_COOLDOWN seconds; one missing for this key/region never returns.
+MODEL_COOLDOWN = {}
+GEMINI_COOLDOWN = 30
+
+# Shared HTTP session so relay downloads reuse pooled keep-alive connections
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    # Relay Retry-After values are unbounded and not covered by the request
+    # timeout, so rely on our own backoff (0.5 s, 1 s, 2 s) instead
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 502, 503, 504],
+        respect_retry_after_header=False,
+    ),
+))
+# Some relays reject the default python-requests agent; set headers once here
+http_session.headers.update({
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
+    "Accept": "audio/*,*/*;q=0.8",
+})
 
 app = FastAPI()
 
@@ -31,35 +104,221 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-os.makedirs("temp", exist_ok=True)
+# Where relay downloads are staged for ffmpeg. Point TEMP_DIR at a tmpfs such
+# as /dev/shm to keep them in RAM, if the container's shm is big enough for
+# a full-length download (Docker defaults to 64 MB).
+TEMP_DIR = os.getenv("TEMP_DIR", "temp")
+os.makedirs(TEMP_DIR, exist_ok=True)
+
+# Relay link -> transcript, so retries for the same audio skip download + Groq
+TRANSCRIPT_CACHE = TTLCache(maxsize=1024, ttl=3600)
+# sha256 of downloaded audio -> transcript, for the same file behind a new link
+AUDIO_TRANSCRIPT_CACHE = TTLCache(maxsize=256, ttl=24 * 3600)
+# "<transcript digest>:<language>" -> generated notes markdown
+NOTES_CACHE = TTLCache(maxsize=256, ttl=24 * 3600)
+# "<context digest>:<normalized question>" -> chat answer
+CHAT_CACHE = TTLCache(maxsize=1024, ttl=3600)
+
+# Chat transcripts long enough are stored once as Gemini cached content, so
+# follow-up turns only send the question. Explicit caching needs a pinned
+# model version and rejects prompts below its minimum token count.
+#
+# Cost (gemini-2.0-flash list prices, per 1M transcript tokens): a cached turn
+# saves $0.075 ($0.10 input vs $0.025 cached), while storage costs $1.00/hour,
+# i.e. ~$0.067 per 4 minutes. So the cache keeps a short 4-minute TTL that is
+# pushed forward on every hit: each cached turn pays for the storage it
+# extends, and an idle chat stops paying within 4 minutes. It is only built
+# once a second question arrives inside that window.
+CHAT_CONTEXT_MODEL = "models/gemini-2.0-flash-001"
+CHAT_CONTEXT_MIN_TOKENS = 4096
+CHAT_CONTEXT_TTL = datetime.timedelta(minutes=4)
+
+def _delete_cached_content(cached):
+    try:
+        cached.delete()
+    except Exception as e:
+        print(f"⚠️ Could not delete Gemini context cache {cached.name}: {e}")
+
+class _ChatContextCache(TTLCache):
+    """TTLCache that also deletes the server-side cache of LRU-evicted entries."""
+
+    def popitem(self):
+        key, entry = super().popitem()
+        if entry:
+            asyncio.get_running_loop().run_in_executor(None, _delete_cached_content, entry[0])
+        return key, entry
+
+# context digest -> (CachedContent, model bound to it), or False if not cacheable.
+# Expires locally a little before the server-side cache does, and is re-set
+# (restarting its timer) whenever the server-side TTL is extended.
+CHAT_CONTEXT_MODELS = _ChatContextCache(maxsize=128, ttl=CHAT_CONTEXT_TTL.total_seconds() - 30)
+# Context digests that had a chat turn recently; the next one builds the cache
+CHAT_CONTEXT_SEEN = TTLCache(maxsize=1024, ttl=CHAT_CONTEXT_TTL.total_seconds())
+
+# Identical concurrent requests share one upstream call instead of each paying for it
+INFLIGHT = {}
+
+# Relay responses smaller than this (or with these types) are error pages, not audio
+MIN_AUDIO_BYTES = 10_000
+NON_AUDIO_CONTENT_TYPES = ("text/html", "application/json")
+
+# --- PROMPTS ---
+# Static instructions; the transcript is sent as a separate content part so
+# the (up to 100 KB) text is never copied into one big prompt string.
+
+NOTES_PROMPT = """
+You are an expert AI tutor. Target Language: {language}.
+
+Create a study guide from this transcript:
+1. Summary (Markdown).
+2. Key Concepts (Bullet points).
+3. Quiz (JSON).
+
+Format:
+# 📝 Summary
+...
+## 🔑 Key Concepts
+...
+## 🧠 Quiz
+```json
+[ {{ "question": "...", "options": ["A","B"], "answer": 0 }} ]
+```
+
+Transcript:
+"""
+
+# Max transcript characters sent to Gemini per call
+NOTES_TRANSCRIPT_LIMIT = 100_000
+CHAT_TRANSCRIPT_LIMIT = 20_000
+# How far back from the limit truncation may rewind to end on a full sentence
+SENTENCE_REWIND_CHARS = 2_000
+SENTENCE_ENDINGS = (". ", "? ", "! ", "\n")
+
+CHAT_PROMPT_PREFIX = "Context: "
+CHAT_PROMPT_SUFFIX = "\n\nUser: {question}\nAnswer:"
+
+# Small talk answered locally; no point spending a Gemini round-trip on "hi"
+GREETING_REPLY = "Hi! How can I help you with this video?"
+THANKS_REPLY = "You're welcome! Ask me anything else about the video."
+CHAT_SHORTCUTS = {
+    "hi": GREETING_REPLY,
+    "hello": GREETING_REPLY,
+    "hey": GREETING_REPLY,
+    "thanks": THANKS_REPLY,
+    "thank you": THANKS_REPLY,
+    "thx": THANKS_REPLY,
+}
 
 # --- CORE FUNCTIONS ---
 
+def text_digest(text):
+    """Short, stable cache key for a (possibly huge) transcript."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+class _HashingWriter:
+    """Wraps a binary file so everything written through it is also sha256-hashed."""
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.file.write(data)
+
+def truncate_text(text, limit):
+    """
+    Cuts text to at most `limit` chars, ending on a sentence boundary when one
+    is close to the limit and otherwise on a word boundary, so Gemini never
+    sees half a sentence/word.
+    """
+    if len(text) <= limit:
+        return text
+    floor = max(limit - SENTENCE_REWIND_CHARS, 0)
+    cut = max(text.rfind(mark, floor, limit) for mark in SENTENCE_ENDINGS)
+    if cut > 0:
+        return text[:cut + 1]
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+def remove_file(path):
+    # Runs fire-and-forget on the executor, so log failures here; nobody
+    # awaits the future to see them
+    try:
+        pathlib.Path(path).unlink(missing_ok=True)
+    except OSError as e:
+        print(f"⚠️ Could not delete temp file {path}: {e}")
+
+def notes_cache_key(text, language):
+    return f"{text_digest(text)}:{language}"
+
+def chat_cache_key(context_digest, question):
+    # Same video + same question (ignoring case/spacing) shares one answer
+    return f"{context_digest}:{' '.join(question.lower().split())}"
+
+def chat_shortcut(question):
+    return CHAT_SHORTCUTS.get(question.strip().lower().rstrip("!.?"))
+
 def download_file_from_url(url, filename):
     """
     Downloads a file from a direct URL (provided by Piped/Cobalt).
     This bypasses yt-dlp on the server.
+    Returns the sha256 hex digest of the written file, or None on failure.
     """
     print(f"⬇️ Downloading audio from relay: {url[:50]}...")
     try:
         # We use a stream to handle large files without memory issues
-        with requests.get(url, stream=True, timeout=60) as r:
+        with http_session.get(url, stream=True, timeout=60) as r:
             r.raise_for_status()
+            # Bail out on error pages before writing anything to disk
+            content_type = r.headers.get("Content-Type", "")
+            content_length = r.headers.get("Content-Length")
+            if content_type.startswith(NON_AUDIO_CONTENT_TYPES):
+                print(f"❌ Download Error: relay returned {content_type}, not audio")
+                return None
+            if content_length is not None and int(content_length) < MIN_AUDIO_BYTES:
+                print(f"❌ Download Error: relay returned only {content_length} bytes")
+                return None
+            # Copy the raw socket stream in 1 MiB blocks instead of 8 KiB chunks
+            r.raw.decode_content = True
+            # Hash while writing so cache lookups never re-read the file
             with open(filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        return True
+                writer = _HashingWriter(f)
+                shutil.copyfileobj(r.raw, writer, length=1024 * 1024)
+        return writer.hash.hexdigest()
     except Exception as e:
         print(f"❌ Download Error: {e}")
-        return False
+        return None
+
+def downsample_audio(file_path):
+    """
+    Re-encodes audio to 16 kHz mono Opus at 24 kbps, which is all Whisper uses,
+    so the Groq upload is a fraction of the relay's 128-192 kbps stereo file.
+    ffmpeg writes to a pipe, so the result stays in memory and is never written
+    back to disk. Returns (filename, stream); falls back to the original file
+    if ffmpeg fails.
+    """
+    try:
+        audio, _ = (
+            ffmpeg
+            .input(file_path)
+            .output("pipe:", format="ogg", acodec="libopus", vn=None, ac=1, ar=16000, audio_bitrate="24k")
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        return "audio.ogg", io.BytesIO(audio)
+    except (ffmpeg.Error, OSError) as e:
+        print(f"⚠️ Downsample failed, uploading original audio: {e}")
+        return os.path.basename(file_path), open(file_path, "rb")
 
-def transcribe_with_groq(file_path):
-    """Transcribes audio using Groq (Whisper Large)."""
+def transcribe_with_groq(filename, audio):
+    """Transcribes an open binary audio stream using Groq (Whisper Large)."""
     print("🎙️ Transcribing with Groq...")
     try:
-        with open(file_path, "rb") as file:
+        # Hand the SDK the stream itself so it builds the upload from it
+        # instead of us holding a second full copy of the audio
+        with audio:
             return groq_client.audio.transcriptions.create(
-                file=(file_path, file.read()),
+                file=(filename, audio),
                 model="whisper-large-v3",
                 response_format="text"
             )
@@ -67,39 +326,256 @@ def transcribe_with_groq(file_path):
         print(f"❌ Groq Error: {e}")
         return None
 
-def generate_notes(text, language):
+def _available_models():
+    now = time.monotonic()
+    return [m for m in GEMINI_MODELS if MODEL_COOLDOWN.get(m.model_name, 0) <= now] or list(GEMINI_MODELS)
+
+def _record_failure(model, error):
+    if isinstance(error, google_exceptions.ResourceExhausted):
+        MODEL_COOLDOWN[model.model_name] = time.monotonic() + GEMINI_COOLDOWN
+    elif isinstance(error, google_exceptions.NotFound):
+        MODEL_COOLDOWN[model.model_name] = float("inf")
+
+async def _generate_text(model, prompt):
+    try:
+        response = await model.generate_content_async(prompt, request_options={"retry": GEMINI_RETRY})
+    except Exception as e:
+        _record_failure(model, e)
+        raise
+    return response.text
+
+# Keep proxies (nginx, Render's edge) from caching or buffering event streams
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _sse(data, event=None):
+    # JSON-encode the payload so newlines in markdown can't break SSE framing
+    frame = f"data: {orjson.dumps(data).decode()}\n\n"
+    return f"event: {event}\n{frame}" if event else frame
+
+async def stream_gemini(prompt, cache, cache_key):
+    """
+    Yields a Gemini answer as Server-Sent Events as it is generated, so the
+    client sees the first tokens instead of waiting for the whole response.
+    A cache hit is sent as one event; a completed answer is stored in `cache`.
+    Like ask_gemini, the opening call is retried on 500/503 and falls over to
+    the next available model, but only until the first chunk has been sent;
+    after that a failure ends the stream with an error event.
+    """
+    cached = cache.get(cache_key)
+    if cached is not None:
+        yield _sse(cached)
+        yield _sse("[DONE]", event="done")
+        return
+
+    parts = []
+    error = None
+    for model in _available_models():
+        try:
+            response = await model.generate_content_async(
+                prompt, stream=True, request_options={"retry": GEMINI_RETRY},
+            )
+            async for chunk in response:
+                parts.append(chunk.text)
+                yield _sse(chunk.text)
+        except Exception as e:
+            _record_failure(model, e)
+            print(f"❌ Gemini Stream Error: {e}")
+            error = e
+            if parts:
+                # Part of this model's answer is already on the wire
+                break
+            continue
+
+        cache[cache_key] = "".join(parts)
+        yield _sse("[DONE]", event="done")
+        return
+
+    yield _sse(f"Gemini Error: {error}", event="error")
+
+def _hedge_delay(kind, model):
+    samples = GEMINI_LATENCY[kind, model.model_name]
+    if len(samples) < GEMINI_HEDGE_MIN_SAMPLES:
+        return GEMINI_HEDGE_DEFAULTS[kind]
+    return sorted(samples)[int(0.95 * (len(samples) - 1))]
+
+async def _timed_generate_text(model, prompt, kind):
+    samples = GEMINI_LATENCY[kind, model.model_name]
+    started = time.monotonic()
+    try:
+        text = await _generate_text(model, prompt)
+    except asyncio.CancelledError:
+        elapsed = time.monotonic() - started
+        # Only losses to the hedge; an early client disconnect says nothing
+        if elapsed >= _hedge_delay(kind, model):
+            samples.append(elapsed)
+        raise
+    samples.append(time.monotonic() - started)
+    return text
+
+async def ask_gemini(prompt, kind):
+    """
+    Hedged Gemini call: starts the first available model and, if it fails or
+    runs past the p95 latency of its recent `kind` ("notes"/"chat") calls,
+    races the rest against it. The first successful answer wins; the others
+    are cancelled. Models in cooldown are skipped, so a rate-limited primary
+    doesn't cost every request a 429 round-trip before the fallback starts.
+    """
+    models = _available_models()
+    first = asyncio.create_task(_timed_generate_text(models[0], prompt, kind))
+    tasks = [first]
+    try:
+        await asyncio.wait(tasks, timeout=_hedge_delay(kind, models[0]))
+        if first.done() and first.exception() is None:
+            return first.result()
+
+        tasks.extend(asyncio.create_task(_generate_text(m, prompt)) for m in models[1:])
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _start_flight(key, make_coro):
+    task = INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.ensure_future(make_coro())
+        INFLIGHT[key] = task
+        task.add_done_callback(lambda _: INFLIGHT.pop(key, None))
+    return task
+
+async def single_flight(key, make_coro):
+    """
+    Runs make_coro() at most once per key at a time; callers arriving while
+    it is in flight await the same result. The shared task is shielded so one
+    client disconnecting doesn't cancel it for the others.
+    """
+    return await asyncio.shield(_start_flight(key, make_coro))
+
+def _create_chat_context_model(context):
+    contents = [CHAT_PROMPT_PREFIX + context]
+    # Character counts are a poor proxy near the minimum (and below it the
+    # create call just fails), so ask Gemini for the real token count first
+    tokens = gemini_model.count_tokens(contents).total_tokens
+    if tokens < CHAT_CONTEXT_MIN_TOKENS:
+        return False
+    cached = caching.CachedContent.create(
+        model=CHAT_CONTEXT_MODEL,
+        contents=contents,
+        ttl=CHAT_CONTEXT_TTL,
+    )
+    return cached, genai.GenerativeModel.from_cached_content(cached_content=cached)
+
+async def _extend_chat_context(digest, entry):
+    """Pushes the server-side TTL forward after a hit and restarts the local timer."""
+    try:
+        await asyncio.to_thread(entry[0].update, ttl=CHAT_CONTEXT_TTL)
+    except Exception as e:
+        # Most likely already expired server-side; rebuild on a later turn
+        print(f"⚠️ Could not extend Gemini context cache: {e}")
+        CHAT_CONTEXT_MODELS.pop(digest, None)
+        return
+    CHAT_CONTEXT_MODELS[digest] = entry
+
+async def _build_chat_context_model(context, digest):
+    try:
+        CHAT_CONTEXT_MODELS[digest] = await asyncio.to_thread(_create_chat_context_model, context)
+    except google_exceptions.InvalidArgument as e:
+        # Too short or unsupported for this transcript; retrying won't help
+        print(f"⚠️ Gemini context cache rejected: {e}")
+        CHAT_CONTEXT_MODELS[digest] = False
+    except Exception as e:
+        # Quota blips / 503s: leave it uncached so a later turn retries
+        print(f"⚠️ Gemini context cache unavailable: {e}")
+
+def get_chat_context_model(context, digest):
+    """
+    Returns a model whose prompt prefix is this transcript, cached server-side
+    by Gemini, or None if there isn't one (yet). A question arriving within
+    CHAT_CONTEXT_TTL of the previous one starts building the cache in the
+    background; later turns use it and extend its TTL.
+    """
+    # Text rarely has more tokens than chars, so short chats skip count_tokens
+    if len(context) < CHAT_CONTEXT_MIN_TOKENS:
+        return None
+
+    entry = CHAT_CONTEXT_MODELS.get(digest)
+    if entry is not None:
+        if not entry:
+            return None
+        _start_flight(f"context-ttl:{digest}", lambda: _extend_chat_context(digest, entry))
+        return entry[1]
+
+    if digest in CHAT_CONTEXT_SEEN:
+        _start_flight(f"context:{digest}", lambda: _build_chat_context_model(context, digest))
+    CHAT_CONTEXT_SEEN[digest] = True
+    return None
+
+async def answer_chat(context, digest, question):
+    """Answers from the cached transcript when possible, else with the full prompt."""
+    turn = CHAT_PROMPT_SUFFIX.format(question=question)
+    context_model = get_chat_context_model(context, digest)
+    if context_model is not None:
+        try:
+            return await _generate_text(context_model, turn)
+        except Exception as e:
+            print(f"⚠️ Cached-context chat failed, resending transcript: {e}")
+    return await ask_gemini([CHAT_PROMPT_PREFIX, context, turn], "chat")
+
+async def transcribe_audio_url(audio_url):
+    """Downloads relay audio and transcribes it, caching the transcript per link."""
+    temp_filename = os.path.join(TEMP_DIR, f"{uuid.uuid4().hex}.mp3")
+
+    try:
+        # Blocking requests/Groq calls run in worker threads so the event
+        # loop keeps serving other requests meanwhile
+        # 1. Download the Audio (Server-side, but from a Relay URL)
+        audio_digest = await asyncio.to_thread(download_file_from_url, audio_url, temp_filename)
+        if not audio_digest:
+            raise HTTPException(status_code=400, detail="Failed to download audio from relay link.")
+
+        # 2. Transcribe (unless these exact bytes were transcribed before)
+        transcript = AUDIO_TRANSCRIPT_CACHE.get(audio_digest)
+        if transcript is None:
+            filename, audio = await asyncio.to_thread(downsample_audio, temp_filename)
+            transcript = await asyncio.to_thread(transcribe_with_groq, filename, audio)
+            if not transcript:
+                raise HTTPException(status_code=500, detail="Transcription failed.")
+            AUDIO_TRANSCRIPT_CACHE[audio_digest] = transcript
+
+    finally:
+        # Delete on a worker thread without waiting, so cleanup never delays the response
+        asyncio.get_running_loop().run_in_executor(None, remove_file, temp_filename)
+
+    TRANSCRIPT_CACHE[audio_url] = transcript
+    return transcript
+
+async def generate_notes(text, language):
     """Summarizes text using Gemini."""
     if not text: return None
+
+    cache_key = notes_cache_key(text, language)
+    notes = NOTES_CACHE.get(cache_key)
+    if notes is not None:
+        return notes
+
     print("🧠 Generating Notes with Gemini...")
     
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    prompt = f"""
-    You are an expert AI tutor. Target Language: {language}.
-    
-    Create a study guide from this transcript:
-    1. Summary (Markdown).
-    2. Key Concepts (Bullet points).
-    3. Quiz (JSON).
-
-    Format:
-    # 📝 Summary
-    ...
-    ## 🔑 Key Concepts
-    ...
-    ## 🧠 Quiz
-    ```json
-    [ {{ "question": "...", "options": ["A","B"], "answer": 0 }} ]
-    ```
-
-    Transcript:
-    {text[:100000]}
-    """
+    prompt = [NOTES_PROMPT.format(language=language), truncate_text(text, NOTES_TRANSCRIPT_LIMIT)]
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        notes = await single_flight(f"notes:{cache_key}", lambda: ask_gemini(prompt, "notes"))
     except Exception as e:
         return f"Gemini Error: {e}"
 
+    NOTES_CACHE[cache_key] = notes
+    return notes
+
 # --- ENDPOINTS ---
 
 @app.post("/process-audio-url")
@@ -107,40 +583,68 @@ async def process_audio_url(audio_url: str = Form(...), language: str = Form(...
     """
     Receives a direct Audio Link (from Piped), downloads, transcribes, and summarizes.
     """
-    temp_filename = f"temp/{int(time.time())}.mp3"
-    
-    try:
-        # 1. Download the Audio (Server-side, but from a Relay URL)
-        success = download_file_from_url(audio_url, temp_filename)
-        if not success:
-            raise HTTPException(status_code=400, detail="Failed to download audio from relay link.")
-
-        # 2. Transcribe
-        transcript = transcribe_with_groq(temp_filename)
-        if not transcript:
-            raise HTTPException(status_code=500, detail="Transcription failed.")
+    transcript = TRANSCRIPT_CACHE.get(audio_url)
+    if transcript is None:
+        # Concurrent requests for the same link share one download + transcription
+        transcript = await single_flight(f"audio:{audio_url}", lambda: transcribe_audio_url(audio_url))
 
-        # 3. Summarize
-        notes = generate_notes(transcript, language)
-        
-        return {"status": "success", "markdown": notes, "transcript": transcript}
+    # 3. Summarize
+    notes = await generate_notes(transcript, language)
 
-    finally:
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+    return {"status": "success", "markdown": notes, "transcript": transcript}
 
 @app.post("/process-transcript")
 async def process_transcript(transcript: str = Form(...), language: str = Form(...)):
     """Backup: If frontend already found text, just summarize it."""
-    notes = generate_notes(transcript, language)
+    notes = await generate_notes(transcript, language)
     return {"status": "success", "markdown": notes}
 
+@app.post("/process-transcript-stream")
+async def process_transcript_stream(transcript: str = Form(...), language: str = Form(...)):
+    """Same as /process-transcript, but streams the notes as Server-Sent Events."""
+    prompt = [NOTES_PROMPT.format(language=language), truncate_text(transcript, NOTES_TRANSCRIPT_LIMIT)]
+    return StreamingResponse(
+        stream_gemini(prompt, NOTES_CACHE, notes_cache_key(transcript, language)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
 @app.post("/chat")
 async def chat_endpoint(question: str = Form(...), transcript: str = Form(...)):
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    prompt = f"Context: {transcript[:20000]}\n\nUser: {question}\nAnswer:"
+    shortcut = chat_shortcut(question)
+    if shortcut is not None:
+        return {"answer": shortcut}
+
+    context = truncate_text(transcript, CHAT_TRANSCRIPT_LIMIT)
+    digest = text_digest(context)
+    cache_key = chat_cache_key(digest, question)
+    answer = CHAT_CACHE.get(cache_key)
+    if answer is not None:
+        return {"answer": answer}
+
     try:
-        response = model.generate_content(prompt)
-        return {"answer": response.text}
-    except:
+        answer = await single_flight(f"chat:{cache_key}", lambda: answer_chat(context, digest, question))
+    except Exception:
         return {"answer": "I am having trouble thinking right now."}
+
+    CHAT_CACHE[cache_key] = answer
+    return {"answer": answer}
+
+@app.post("/chat-stream")
+async def chat_stream_endpoint(question: str = Form(...), transcript: str = Form(...)):
+    """Same as /chat, but streams the answer as Server-Sent Events."""
+    shortcut = chat_shortcut(question)
+    if shortcut is not None:
+        return StreamingResponse(
+            iter([_sse(shortcut), _sse("[DONE]", event="done")]),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    context = truncate_text(transcript, CHAT_TRANSCRIPT_LIMIT)
+    prompt = [CHAT_PROMPT_PREFIX, context, CHAT_PROMPT_SUFFIX.format(question=question)]
+    return StreamingResponse(
+        stream_gemini(prompt, CHAT_CACHE, chat_cache_key(text_digest(context), question)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )